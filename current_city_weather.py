@@ -10,24 +10,254 @@ cities!
 Current weather is frequently updated based on global models and data from more
 than 40,000 weather stations
 """
-import argparse
-import urllib.request
-import xml.dom.minidom
+import functools
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from urllib.parse import urlencode
+
+SERVER_NAME = "https://api.openweathermap.org"
+DATA_PATH = "/data/2.5/weather"
+WEATHER_URL = SERVER_NAME + DATA_PATH
+CITY_FILE_NAME = "weather.json"
+REQUEST_TIMEOUT = 10
+WEATHER_CACHE_TTL = 600
+WEATHER_CACHE_SIZE = 1024
+MAX_WORKERS = 16
+USAGE = (
+    "usage: current_city_weather.py city_name {kelvin,celsius,fahrenheit} "
+    "api_key\n"
+)
+
+# Bound format method of the report, fields are read off the WeatherReport
+REPORT_TEMPLATE = (
+    "Weather report for {city_name}:\n"
+    "Temperature is at {report.temperature_val} {report.temp_unit}\n"
+    "Humidity is {report.humidity_val}{report.humidity_unit}\n"
+    "Wind is at {report.wind_val} speed meaning {report.wind_desc}\n"
+    "Air pressure is {report.pressure_val} {report.pressure_unit}\n"
+    "Clouds coverage is {report.clouds_val}% meaning {report.clouds_desc}\n\n"
+).format
+
+# Shared session so successive lookups reuse the same keep-alive connection,
+# created on first use, see _get_session
+_session = None
+_session_lock = threading.Lock()
 
-SERVER_NAME = "http://api.openweathermap.org"
-DATA_PATH = "/data/2.5/weather?q="
-CITY_FILE_NAME = "weather.xml"
-
-city_weather_dict = {}
 unit_conversion_dict = {
     "fahrenheit": "imperial", "celsius": "metric", "kelvin": ""
 }
+api_unit_conversion_dict = {v: k for k, v in unit_conversion_dict.items()}
+MPH_TO_METER_SEC = 0.44704
+
+# Lower bounds of the descriptions the site gives for wind speed (meter/sec,
+# beaufort scale) and clouds coverage (%), the json data holds only values
+wind_desc_bounds = (
+    (32.7, "hurricane"), (28.5, "violent storm"), (24.5, "storm"),
+    (20.8, "severe gale"), (17.2, "gale"), (13.9, "high wind, near gale"),
+    (10.8, "strong breeze"), (8.0, "fresh breeze"), (5.5, "moderate breeze"),
+    (3.4, "gentle breeze"), (1.6, "light breeze"), (0.3, "light air"),
+    (0, "calm"),
+)
+clouds_desc_bounds = (
+    (85, "overcast clouds"), (51, "broken clouds"), (25, "scattered clouds"),
+    (11, "few clouds"), (0, "clear sky"),
+)
 
 
 class WeatherException(Exception):
     pass
 
 
+@dataclass(slots=True, frozen=True)
+class WeatherReport:
+    """
+    Current weather attributes of a city as reported by the site
+    """
+    temperature_val: str
+    temp_unit: str
+    humidity_val: str
+    humidity_unit: str
+    wind_val: str
+    wind_desc: str
+    pressure_val: str
+    pressure_unit: str
+    clouds_val: str
+    clouds_desc: str
+
+
+def _ttl_cache(ttl, maxsize):
+    """
+    Memoize a function for ttl seconds, keeping at most maxsize results
+
+    The cache is thread safe and can be invalidated by calling cache_clear on
+    the decorated function. The function itself is called outside the lock
+    so concurrent misses do not serialize each other
+    """
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            now = time.monotonic()
+            with lock:
+                entry = cache.get(args)
+            if entry is not None and now - entry[0] < ttl:
+                return entry[1]
+            result = func(*args)
+            with lock:
+                cache[args] = (now, result)
+                cache.move_to_end(args)
+                if len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return result
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
+
+
+def _get_session():
+    """
+    Return the shared requests session, importing requests and creating the
+    session on first use so the import cost is paid only when fetching
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            session.mount(
+                SERVER_NAME, HTTPAdapter(pool_connections=10, pool_maxsize=50)
+            )
+            _session = session
+    return _session
+
+
+def _fetch_weather_bytes(city_name, units, api_key, mode, persist=False):
+    """
+    Retrieve weather info from openweathermap site and keep it in memory
+
+    Args:
+        city_name (str): city to retrieve the weather info for
+        units (str): temperature units, one of unit_conversion_dict keys
+        api_key (str): openweathermap api key
+        mode (str): response format requested from the site
+        persist (bool): also write the retrieved info to CITY_FILE_NAME,
+            useful for debugging
+
+    Returns:
+        bytes: raw json data retrieved from the site
+    """
+    import requests
+
+    api_units = unit_conversion_dict[units]
+    try:
+        resp = _get_session().get(
+            WEATHER_URL + "?" + urlencode({
+                "q": city_name, "appid": api_key, "mode": mode,
+                "units": api_units
+            }),
+            timeout=REQUEST_TIMEOUT
+        )
+        resp.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        raise WeatherException(
+            "Retrieving weather data failed with error: %s" % e
+        )
+    weather_data = resp.content
+
+    if persist:
+        try:
+            with open(CITY_FILE_NAME, mode='wb') as file:
+                file.write(weather_data)
+        except OSError as e:
+            print("File operations failed with error: %s" % e)
+
+    return weather_data
+
+
+def _describe(val, desc_bounds):
+    """
+    Return the description of the first bound val reaches in desc_bounds
+    """
+    for bound, desc in desc_bounds:
+        if val >= bound:
+            return desc
+    return desc_bounds[-1][1]
+
+
+def _parse_weather_bytes(weather_data, api_units):
+    """
+    Parse the relevant weather attributes out of the retrieved json data
+
+    Args:
+        weather_data (bytes): raw json data retrieved from the site
+        api_units (str): units the data was requested in from the site
+
+    Returns:
+        WeatherReport: weather attributes of the city
+    """
+    try:
+        data = json.loads(weather_data)
+    except ValueError as e:
+        raise WeatherException(
+            "Parsing weather data failed with error: %s" % e
+        )
+
+    temperature_val = str(data["main"]["temp"])
+    temp_unit = api_unit_conversion_dict[api_units]
+    humidity_val = str(data["main"]["humidity"])
+    humidity_unit = "%"
+    wind_speed = data["wind"]["speed"]
+    wind_val = str(wind_speed)
+    if api_units == "imperial":
+        wind_speed *= MPH_TO_METER_SEC
+    wind_desc = _describe(wind_speed, wind_desc_bounds)
+    clouds_coverage = data["clouds"]["all"]
+    clouds_val = str(clouds_coverage)
+    clouds_desc = _describe(clouds_coverage, clouds_desc_bounds)
+    pressure_val = str(data["main"]["pressure"])
+    pressure_unit = "hPa"
+
+    return WeatherReport(
+        temperature_val=temperature_val, temp_unit=temp_unit,
+        humidity_val=humidity_val, humidity_unit=humidity_unit,
+        wind_val=wind_val, wind_desc=wind_desc,
+        pressure_val=pressure_val, pressure_unit=pressure_unit,
+        clouds_val=clouds_val, clouds_desc=clouds_desc,
+    )
+
+
+@_ttl_cache(ttl=WEATHER_CACHE_TTL, maxsize=WEATHER_CACHE_SIZE)
+def _get_weather(city_name, units, api_key, mode):
+    """
+    Retrieve and parse the weather attributes of a city
+
+    Results are cached per arguments for WEATHER_CACHE_TTL seconds, as the
+    site updates its data only every few minutes. Pass the city name in
+    lower case for a better hit rate, and call _get_weather.cache_clear() to
+    invalidate the cache
+
+    Returns:
+        WeatherReport: weather attributes of the city
+    """
+    return _parse_weather_bytes(
+        _fetch_weather_bytes(city_name, units, api_key, mode),
+        unit_conversion_dict[units]
+    )
+
+
 class CityWeather:
     """
     Class the represents real time city weather
@@ -38,7 +268,8 @@ class CityWeather:
         self.__city_name = city_name
         self.__units = units
         self.__api_key = api_key
-        self.mode = 'xml'
+        self.mode = 'json'
+        self._report = None
 
     @property
     def city_name(self):
@@ -61,12 +292,11 @@ class CityWeather:
 
     @units.setter
     def units(self, val):
-        for k in unit_conversion_dict:
-            if val != k:
-                raise WeatherException(
-                    "Wrong value is set for temperature units, enter only %s"
-                    % unit_conversion_dict.keys()
-                )
+        if val not in unit_conversion_dict:
+            raise WeatherException(
+                "Wrong value %r is set for temperature units, enter only %s"
+                % (val, list(unit_conversion_dict))
+            )
         self.__units = val
 
     @property
@@ -76,7 +306,7 @@ class CityWeather:
     @api_key.setter
     def api_key(self, val):
         if val:
-            self.api_key = val
+            self.__api_key = val
         else:
             raise WeatherException(
                 "No value was entered to api_key.\nPlease enter a valid key "
@@ -84,105 +314,44 @@ class CityWeather:
                 "https://openweathermap.org/appid"
             )
 
-    def create_city_weather_data_file(self):
-        """
-        Retrieve weather info from openweathermap site and a create a file with
-        retrieved info
+    def update_city_weather_dict(self, persist=False):
         """
-        api_units = unit_conversion_dict[self.units]
-        urlh = urllib.request.urlopen(
-            SERVER_NAME + DATA_PATH + self.city_name + "&appid=" + self.api_key
-            + "&mode=" + self.mode + "&units=" + api_units
-        )
-        xml_data = urlh.read()
+        Update the city weather report with relevant parse weather attributes
+        taken from the json data retrieved from the openweathermap site
 
-        try:
-            with open(CITY_FILE_NAME, mode='wb') as file:
-                file.write(xml_data)
-        except WeatherException as e:
-            print("File operations failed with error: %s" % e)
+        Weather attributes are cached for WEATHER_CACHE_TTL seconds, see
+        _get_weather
 
-    def update_city_weather_dict(self):
+        Args:
+            persist (bool): bypass the cache and also write the retrieved
+                json data to CITY_FILE_NAME, useful for debugging
         """
-        Update city_weather dictionary with relevant parse weather attributes
-        taken from the xml data file retrieved from the
-        """
-        self.create_city_weather_data_file()
-        try:
-            document = xml.dom.minidom.parse(CITY_FILE_NAME)
-        except WeatherException as e:
-            print(
-                "Parsing data file %s failed with error: %s" % (
-                    CITY_FILE_NAME, e
-                )
+        if persist:
+            self._report = _parse_weather_bytes(
+                _fetch_weather_bytes(
+                    self.city_name, self.units, self.api_key, self.mode,
+                    persist=True
+                ),
+                unit_conversion_dict[self.units]
             )
-
-        node_current = document.getElementsByTagName("current")[0]
-        node_temp = node_current.getElementsByTagName("temperature")
-        node_wind = node_current.getElementsByTagName("wind")
-        node_humidity = node_current.getElementsByTagName("humidity")
-        node_pressure = node_current.getElementsByTagName("pressure")
-        node_clouds = node_current.getElementsByTagName("clouds")
-        temperature_val = node_temp[0].getAttribute("value")
-        api_temp_unit = node_temp[0].getAttribute("unit")
-        if api_temp_unit == "metric":
-            temp_unit = [k for k, v in unit_conversion_dict.items() if
-                         v == api_temp_unit][0]
         else:
-            temp_unit = api_temp_unit
-        humidity_val = node_humidity[0].getAttribute("value")
-        humidity_unit = node_humidity[0].getAttribute("unit")
-        wind_val = node_wind[0].getElementsByTagName("speed")[0].getAttribute(
-            "value"
-        )
-        wind_desc = node_wind[0].getElementsByTagName("speed")[0].getAttribute(
-            "name"
-        )
-        clouds_val = node_clouds[0].getAttribute("value")
-        clouds_desc = node_clouds[0].getAttribute("name")
-        pressure_val = node_pressure[0].getAttribute("value")
-        pressure_unit = node_pressure[0].getAttribute("unit")
-
-        city_weather_dict[self.city_name] = {
-            'temperature': {
-                'temperature_val': temperature_val, 'temp_unit': temp_unit
-            },
-            'humidity': {
-                'humidity_val': humidity_val, 'humidity_unit': humidity_unit
-            },
-            'wind': {'wind_val': wind_val, 'wind_desc': wind_desc},
-            'pressure': {
-                'pressure_val': pressure_val, 'pressure_unit': pressure_unit
-            },
-            'clouds': {'clouds_val': clouds_val, 'clouds_desc': clouds_desc},
-        }
+            self._report = _get_weather(
+                self.city_name.lower(), self.units, self.api_key, self.mode
+            )
 
     def print_city_weather_report(self):
         """
         Print current city weather report with relevant weather attributes as
         Temperature ,humidity, wind , pressure & clouds statsistics
         """
-        city_name = self.city_name
-        print(
-            "Weather report for %s:\n"
-            "Temperature is at %s %s\n"
-            "Humidity is %s%s\n"
-            "Wind is at %s speed meaning %s\n"
-            "Air pressure is %s %s\n"
-            "Clouds coverage is %s%% meaning %s\n" % (
-                city_name,
-                city_weather_dict[city_name]['temperature']['temperature_val'],
-                city_weather_dict[city_name]['temperature']['temp_unit'],
-                city_weather_dict[city_name]['humidity']['humidity_val'],
-                city_weather_dict[city_name]['humidity']['humidity_unit'],
-                city_weather_dict[city_name]['wind']['wind_val'],
-                city_weather_dict[city_name]['wind']['wind_desc'].lower(),
-                city_weather_dict[city_name]['pressure']['pressure_val'],
-                city_weather_dict[city_name]['pressure']['pressure_unit'],
-                city_weather_dict[city_name]['clouds']['clouds_val'],
-                city_weather_dict[city_name]['clouds']['clouds_desc'].lower(),
+        if self._report is None:
+            raise WeatherException(
+                "No weather report for %s yet, call update_city_weather_dict "
+                "first" % self.city_name
             )
-        )
+        sys.stdout.write(REPORT_TEMPLATE(
+            city_name=self.city_name, report=self._report
+        ))
 
 
 def run(city_name, units, api_key):
@@ -198,6 +367,27 @@ def run(city_name, units, api_key):
     weather_obj.print_city_weather_report()
 
 
+def run_many(cities, units, api_key, max_workers=MAX_WORKERS):
+    """
+    Provide current weather reports for several cities at once
+    Weather data of all cities is retrieved concurrently over the shared
+    session and the reports are printed in the order of the given cities
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    weather_objs = [
+        CityWeather(city_name=city_name, units=units, api_key=api_key)
+        for city_name in cities
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(
+            lambda weather_obj: weather_obj.update_city_weather_dict(),
+            weather_objs
+        ))
+    for weather_obj in weather_objs:
+        weather_obj.print_city_weather_report()
+
+
 def main():
     """
     Create weather current city weather report - running script directly
@@ -207,27 +397,17 @@ def main():
     python3 /path/to/script/current_city_weather.py
     "tel aviv" celsius 0e0ab2271488dc844f64ead7184b53fc
     """
+    args = sys.argv[1:]
+    if "-h" in args or "--help" in args:
+        sys.stdout.write(USAGE)
+        return
+    if len(args) != 3 or args[1] not in unit_conversion_dict:
+        sys.stderr.write(USAGE)
+        sys.exit(2)
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "city_name", help="city name in small letters", default="tel aviv"
-    )
-    parser.add_argument(
-        "temp_units",
-        help="temperature units kelvin or celsius or fahrenheit",
-        default="tel aviv", choices=["kelvin", "celsius", "fahrenheit"]
-    )
-    parser.add_argument(
-        "api_key", help="api_key you get when signing in to the openweathermap"
-                        " site"
-    )
-
-    args = parser.parse_args()
-    city_name, temp_units, api_key = args.city_name, args.temp_units, args.api_key
+    city_name, temp_units, api_key = args
+    run(city_name=city_name, units=temp_units, api_key=api_key)
 
-    ob = CityWeather(city_name=city_name, units=temp_units, api_key=api_key)
-    ob.update_city_weather_dict()
-    ob.print_city_weather_report()
 
 if __name__ == '__main__':
     main()